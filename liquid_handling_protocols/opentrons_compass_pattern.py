@@ -1,4 +1,8 @@
-from opentrons import protocol_api
+import functools
+import math
+from dataclasses import dataclass
+
+from opentrons import protocol_api, types
 
 """
 Opentrons Compass Pattern Script:
@@ -11,16 +15,22 @@ Description:
 1. Constants at the beginning of the script define labware types, deck positions, pipette
    configurations, and transfer/mixing parameters.
 2. The script is configured for a specific source plate and a destination plate, both of 12 wells.
-3. A set of transfers is defined where each transfer contains a source well, destination well, and
+3. A set of transfers is defined where each Transfer contains a source well, destination well, and
    the volume to be transferred.
 4. A compass mixing pattern function is defined to ensure thorough mixing in a specified well. The
-   pipette moves to the center, north, south, east, and west points within the well and performs
-   mixing actions.
+   pipette aspirates at the center of the well and dispenses in turn at the north, south, east,
+   and west points, repeating this orbit a set number of times.
 5. For each transfer defined:
     a. A specific tip from the tiprack is picked based on the predefined tip consumption order.
     b. The pipette goes to the source well, mixes the liquid using the compass mixing pattern.
-    c. It then aspirates the defined volume from the source well.
-    d. The pipette moves to the destination well and dispenses the liquid.
+    c. It then aspirates the defined volume from the source well, split into equal chunks of at
+       most CHUNK_VOLUME.
+    d. The pipette moves to the destination well and dispenses each chunk. Unless
+       CONSERVATIVE_SINGLE_DISPENSE is set, consecutive transfers from the same source well that
+       fit in one chunk share a tip and a single aspirate, which is dispensed MULTI_DISPENSE_DEPTH
+       below the top of each of their destinations, above the liquid rather than at the well
+       bottom, so the tip never touches their contents. Each batch aspirates an extra
+       DISPOSAL_VOLUME that is blown out into the trash after the last destination.
     e. The used tip is then dropped.
 
 6. After all transfers are completed, the robot's motors are moved to their home positions.
@@ -36,32 +46,183 @@ metadata = {
     "author": "Monomer Open-Source",  # Modify with your name and email
     "description": "Automated liquid transfer and mixing in a 12-well plate using OT-2, "
     "demonstrating a compass mix pattern",
-    "apiLevel": "2.12",  # Ensure this matches the version of Opentrons you are using
+    "apiLevel": "2.15",  # Ensure this matches the version of Opentrons you are using
 }
 
+
+@dataclass(frozen=True, slots=True)
+class Transfer:
+    """A single source well to destination well transfer."""
+
+    source_well: str
+    dest_well: str
+    volume_ul: float
+
+
+@dataclass(frozen=True, slots=True)
+class MixParams:
+    """Parameters for the compass mixing pattern, shared by every transfer."""
+
+    volume: float
+    num_orbits: int
+    mm_from_center: float
+    mm_from_bottom: float
+    mix_aspirate_rate: float
+    mix_dispense_rate: float
+
+
 # Constants to change for your specific protocol
 SOURCE_PLATE_TYPE = "corning_12_wellplate_6.9ml_flat"
 SOURCE_PLATE_DECK_SLOT = 1
-TRANSFERS = [
-    {"source_well": "A1", "dest_well": "A1", "volume_ul": 1000},
-    {"source_well": "B1", "dest_well": "B1", "volume_ul": 1000},
-]
-MIX_PARAMS = {
-    "volume": 1000,
-    "num_mixes_at_each_point": 3,
-    "mm_from_center": 7.5,  # Number of mm from center of well to mix at for each corner
-    "mm_from_bottom": 2.5,  # Number of mm from bottom of the well to aspirate and dispense at for
+TRANSFERS = (
+    Transfer(source_well="A1", dest_well="A1", volume_ul=1000),
+    Transfer(source_well="B1", dest_well="B1", volume_ul=1000),
+)
+REORDER_TRANSFERS_ABOVE = 8  # Longer TRANSFERS lists are reordered to shorten head travel
+DISPENSE_CLEARANCE = 5  # mm above the destination well top to approach and retract to
+CHUNK_VOLUME = 500  # Largest volume in uL moved per aspirate/dispense, keeps the plunger mid-range
+# Consecutive transfers from one source well that fit in a single CHUNK_VOLUME aspirate are
+# dispensed to all their destinations from that aspirate, in declared order. Batched transfers are
+# dispensed MULTI_DISPENSE_DEPTH below the well top rather than at the well bottom, so where a
+# transfer lands depends on its neighbours. Set to True when per-well dispense accuracy matters more
+CONSERVATIVE_SINGLE_DISPENSE = False
+MULTI_DISPENSE_DEPTH = 5  # mm below the destination well top to dispense at, above the liquid
+DISPOSAL_VOLUME = 100  # Extra uL aspirated per batch and blown out into the trash afterwards
+TRANSFER_ASPIRATE_RATE = 1.0  # flow rate, 1.0 is the opentrons default
+TRANSFER_DISPENSE_RATE = 1.0  # flow rate, 1.0 is the opentrons default
+MIX_PARAMS = MixParams(
+    volume=1000,
+    num_orbits=3,  # Number of aspirate-at-center, dispense-at-each-corner cycles
+    mm_from_center=7.5,  # Number of mm from center of well to mix at for each corner
+    mm_from_bottom=2.5,  # Number of mm from bottom of the well to aspirate and dispense at for
     # mixing
-    "mix_rate": 5.5,  # flow rate, 1.0 is the opentrons default
-}
+    mix_aspirate_rate=5.5,  # flow rate, 1.0 is the opentrons default
+    mix_dispense_rate=5.5,  # flow rate, 1.0 is the opentrons default
+)
 DESTINATION_PLATE_TYPE = "corning_12_wellplate_6.9ml_flat"
 DESTINATION_PLATE_SLOT = 2
-PIPETTE_TYPE = "p1000_single_gen2"
+PIPETTE_TYPE = "p1000_single_gen2"  # 8-channel heads (9 mm pitch) do not fit 12-well rows
 PIPETTE_SIDE = "left"
 TIPRACK_TYPE = "opentrons_96_filtertiprack_1000ul"
 TIPRACK_SLOT = 4
 TIPRACK_TIPS = ["A1", "B1"]  # Array of tips in tip box to consume in order
 
+# Dispense points of each mixing orbit relative to the well center, derived from MIX_PARAMS
+COMPASS_OFFSETS = (
+    types.Point(0, MIX_PARAMS.mm_from_center, 0),  # north
+    types.Point(0, -MIX_PARAMS.mm_from_center, 0),  # south
+    types.Point(MIX_PARAMS.mm_from_center, 0, 0),  # east
+    types.Point(-MIX_PARAMS.mm_from_center, 0, 0),  # west
+)
+
+
+def _split(total_volume: float, chunk_volume: float):
+    """
+    Yields equal chunks, each no larger than chunk_volume, that sum to total_volume.
+    """
+    num_chunks = math.ceil(total_volume / chunk_volume)
+    for _ in range(num_chunks):
+        yield total_volume / num_chunks
+
+
+def _order_by_travel(resolved_transfers: list) -> list:
+    """
+    Greedily reorders (source well, destination well, chunk volumes) transfers so that each
+    transfer starts at the source well nearest, in XY, to where the previous one dispensed. The
+    first transfer is kept in place.
+    """
+    remaining = list(resolved_transfers)
+    ordered = [remaining.pop(0)]
+    while remaining:
+        last = ordered[-1][1].center().point
+        nearest = min(
+            range(len(remaining)),
+            key=lambda i: math.hypot(
+                remaining[i][0].center().point.x - last.x,
+                remaining[i][0].center().point.y - last.y,
+            ),
+        )
+        ordered.append(remaining.pop(nearest))
+    return ordered
+
+
+def _group_by_source(resolved_transfers: list, max_volume: float) -> list:
+    """
+    Groups (source well, destination well, chunk volumes) transfers into (source well,
+    [(destination well, chunk volumes), ...]) batches. Consecutive single-chunk transfers that share
+    a source well are batched while their combined volume fits in max_volume; every other transfer
+    gets a batch of its own. The order of the transfers is kept.
+    """
+    batches = []
+    batch_volume = None  # Volume of the last batch while it still accepts transfers
+    for src, dst, chunk_volumes in resolved_transfers:
+        volume = sum(chunk_volumes)
+        if (
+            len(chunk_volumes) == 1
+            and batch_volume is not None
+            and batches[-1][0].well_name == src.well_name
+            and batch_volume + volume <= max_volume
+        ):
+            batches[-1][1].append((dst, chunk_volumes))
+            batch_volume += volume
+        else:
+            batches.append((src, [(dst, chunk_volumes)]))
+            batch_volume = volume if len(chunk_volumes) == 1 else None
+    return batches
+
+
+def compass_mix_pattern(
+    pipette: protocol_api.InstrumentContext,
+    base_loc: types.Location,
+    num_orbits: int,
+    volume: float,
+    aspirate_flow_rate: float,
+    dispense_flow_rate: float,
+):
+    """
+    Performs a mixing pattern in a specified well using a compass pattern: center, north,
+    south, east, and west.
+
+    Each orbit aspirates the full mixing volume at the center of the well and then dispenses a
+    quarter of it at each compass point in turn, so the liquid is agitated across the whole
+    well with one plunger reversal per orbit. The order is Aspirate Center -> Dispense North ->
+    South -> East -> West
+
+    Parameters:
+    - pipette (InstrumentContext): The pipette, with a tip attached, used to mix.
+    - base_loc (Location): The center of the well at the height where the mixing is to be
+                           performed.
+    - num_orbits (int): The number of center-to-compass orbits to perform.
+    - volume (float): The volume in microliters to be aspirated at the center of each orbit.
+    - aspirate_flow_rate (float): The flow rate in microliters per second to aspirate at while
+                                  mixing.
+    - dispense_flow_rate (float): The flow rate in microliters per second to dispense at while
+                                  mixing.
+
+    The pipette's flow rates are set once for the whole pattern and restored afterwards.
+
+    Each compass point is base_loc moved by one of COMPASS_OFFSETS, so the plate's calibration
+    offset is never modified.
+
+    Note:
+    Ensure that the provided volume, the height of base_loc, and the aspirate and dispense flow
+    rates are suitable for the plate and liquid properties to avoid spillage or insufficient
+    mixing.
+    """
+
+    compass_points = [base_loc.move(offset) for offset in COMPASS_OFFSETS]
+    dispense_volume = volume / len(compass_points)
+    previous_aspirate_flow_rate = pipette.flow_rate.aspirate
+    previous_dispense_flow_rate = pipette.flow_rate.dispense
+    pipette.flow_rate.aspirate = aspirate_flow_rate
+    pipette.flow_rate.dispense = dispense_flow_rate
+    for _ in range(num_orbits):
+        pipette.aspirate(volume, base_loc)
+        for point in compass_points:
+            pipette.dispense(dispense_volume, point)
+    pipette.flow_rate.aspirate = previous_aspirate_flow_rate
+    pipette.flow_rate.dispense = previous_dispense_flow_rate
+
 
 def run(protocol: protocol_api.ProtocolContext):
     # Defining on-deck plates/consumables
@@ -71,121 +232,81 @@ def run(protocol: protocol_api.ProtocolContext):
 
     # Define pipette you are using
     pipette = protocol.load_instrument(PIPETTE_TYPE, PIPETTE_SIDE, tip_racks=[tiprack])
+    default_aspirate_flow_rate = pipette.flow_rate.aspirate
+    default_dispense_flow_rate = pipette.flow_rate.dispense
+    # Scale the transfer flow rates; the mix sets its own rates
+    pipette.flow_rate.aspirate = default_aspirate_flow_rate * TRANSFER_ASPIRATE_RATE
+    pipette.flow_rate.dispense = default_dispense_flow_rate * TRANSFER_DISPENSE_RATE
 
-    # Define the tip array to iterate through
-    tips_to_consume = iter(TIPRACK_TIPS)
-
-    def compass_mix_pattern(
-        plate,
-        well: str,
-        num_mixes_at_each_point: int,
-        mm_from_center: float,
-        volume: float,
-        mm_from_bottom: float,
-        mix_rate: float,
-    ):
-        """
-        Performs a mixing pattern in a specified well of a plate using a compass pattern: center,
-        north, south, east, and west.
-
-        This method moves the pipette to specified points in the well (following the compass
-        directions) and then mixes the contents. It is designed to ensure thorough mixing in
-        different parts of the well. The order is Mix Center -> North -> South -> East -> West
-
-        Parameters:
-        - plate (object): The plate object where the specified well is located.
-        - well (str): The well in the plate where the mixing is to be performed.
-        - num_mixes_at_each_point (int): The number of mix repetitions to be done at each compass
-                                         point.
-        - mm_from_center (float): The distance in millimeters from the center of the well to move in
-                                  the N/S/E/W directions.
-        - volume (float): The volume in microliters to be aspirated and dispensed during each mix.
-        - mm_from_bottom (float): The distance in millimeters from the bottom of the well where the
-                                  mixing should occur.
-        - mix_rate (float): The rate of mixing, usually a value between 0.1 (slow) and 10 (fast).
-
-        After mixing at all the compass points, the function resets the offset of the pipette to its
-        original position.
-
-        Note:
-        Ensure that the provided volume, depth, and mixing rate are suitable for the plate and
-        liquid properties to avoid spillage or insufficient mixing.
-        """
-
-        # [rest of the method...]
-        # mix center
-        pipette.mix(
-            num_mixes_at_each_point, volume, plate[well].bottom(mm_from_bottom), rate=mix_rate
-        )
-
-        # mix north
-        plate.set_offset(
-            x=0,
-            y=mm_from_center,
-            z=0,
-        )
-        pipette.mix(
-            num_mixes_at_each_point, volume, plate[well].bottom(mm_from_bottom), rate=mix_rate
-        )
-
-        # mix south
-        plate.set_offset(
-            x=0,
-            y=0 - mm_from_center,
-            z=0,
-        )
-        pipette.mix(
-            num_mixes_at_each_point, volume, plate[well].bottom(mm_from_bottom), rate=mix_rate
-        )
+    # Mixing parameters are the same for every transfer, so bind them once
+    mix = functools.partial(
+        compass_mix_pattern,
+        pipette,
+        num_orbits=MIX_PARAMS.num_orbits,
+        volume=MIX_PARAMS.volume,
+        aspirate_flow_rate=default_aspirate_flow_rate * MIX_PARAMS.mix_aspirate_rate,
+        dispense_flow_rate=default_dispense_flow_rate * MIX_PARAMS.mix_dispense_rate,
+    )
 
-        # mix east
-        plate.set_offset(
-            x=mm_from_center,
-            y=0,
-            z=0,
+    # Resolve every transfer's wells, chunk volumes, and tips before the robot starts moving, so the
+    # loop below only issues pipette commands
+    resolved_transfers = [
+        (
+            source_plate[transfer.source_well],
+            destination_plate[transfer.dest_well],
+            tuple(_split(transfer.volume_ul, CHUNK_VOLUME)),
         )
-        pipette.mix(
-            num_mixes_at_each_point, volume, plate[well].bottom(mm_from_bottom), rate=mix_rate
+        for transfer in TRANSFERS
+    ]
+    if len(resolved_transfers) > REORDER_TRANSFERS_ABOVE:
+        resolved_transfers = _order_by_travel(resolved_transfers)
+    if CONSERVATIVE_SINGLE_DISPENSE:
+        batches = [(src, [(dst, chunk_volumes)]) for src, dst, chunk_volumes in resolved_transfers]
+    else:
+        # The disposal volume rides on top of the batch, so it isn't counted against CHUNK_VOLUME
+        batches = _group_by_source(
+            resolved_transfers, min(CHUNK_VOLUME, pipette.max_volume - DISPOSAL_VOLUME)
         )
 
-        # mix west
-        plate.set_offset(
-            x=0 - mm_from_center,
-            y=0,
-            z=0,
-        )
-        pipette.mix(
-            num_mixes_at_each_point, volume, plate[well].bottom(mm_from_bottom), rate=mix_rate
-        )
-
-        # Reset the offset back to the original after mixing
-        plate.set_offset(
-            x=0,
-            y=0,
-            z=0,
+    # zip() would silently drop batches that have no tip assigned
+    if len(TIPRACK_TIPS) < len(batches):
+        raise ValueError(
+            f"TIPRACK_TIPS lists {len(TIPRACK_TIPS)} tips but {len(batches)} are needed"
         )
+    tip_wells = [tiprack[tip_name] for tip_name in TIPRACK_TIPS]
 
     # add volume to all wells
-    for transfer in TRANSFERS:
-        next_tip = tiprack.next_tip(starting_tip=tiprack[next(tips_to_consume)])
-        pipette.pick_up_tip(next_tip)
-        dest_well = transfer["dest_well"]
-        source_well = transfer["source_well"]
-        pipette.move_to(source_plate[source_well].top(2))
-        compass_mix_pattern(
-            source_plate,
-            source_well,
-            MIX_PARAMS["num_mixes_at_each_point"],
-            MIX_PARAMS["mm_from_center"],
-            MIX_PARAMS["volume"],
-            MIX_PARAMS["mm_from_bottom"],
-            MIX_PARAMS["mix_rate"],
-        )
-        pipette.aspirate(transfer["volume_ul"], source_plate[source_well].bottom())
-        pipette.move_to(source_plate[dest_well].top(2))
-        pipette.move_to(destination_plate[dest_well].top(40))
-        pipette.dispense(transfer["volume_ul"], destination_plate[dest_well].bottom())
-        pipette.move_to(destination_plate[dest_well].top(40))
+    for (src, dests), tip_well in zip(batches, tip_wells):
+        # Build each location once and reuse it across the mix and every chunk
+        src_mix = src.bottom(MIX_PARAMS.mm_from_bottom)
+        src_bottom = src.bottom()
+
+        pipette.pick_up_tip(tip_well)
+        pipette.move_to(src.top(2))
+        mix(src_mix)
+        if len(dests) == 1:
+            ((dst, chunk_volumes),) = dests
+            dst_top = dst.top(DISPENSE_CLEARANCE)
+            dst_bottom = dst.bottom()
+            for volume in chunk_volumes:
+                pipette.aspirate(volume, src_bottom)
+                pipette.move_to(dst_top)
+                pipette.dispense(volume, dst_bottom)
+                pipette.move_to(dst_top)
+        else:
+            # One aspirate from the source, then one dispense above the liquid in each
+            # destination so the shared tip never carries one well's contents into the next. The
+            # disposal volume keeps the last dispense as accurate as the others
+            batch_volume = sum(chunk_volumes[0] for _, chunk_volumes in dests)
+            pipette.aspirate(batch_volume + DISPOSAL_VOLUME, src_bottom)
+            for dst, (volume,) in dests:
+                dst_top = dst.top(DISPENSE_CLEARANCE)
+                pipette.move_to(dst_top)
+                pipette.dispense(volume, dst.top(-MULTI_DISPENSE_DEPTH))
+                # Knock off the droplet left hanging after dispensing into the air
+                pipette.touch_tip(dst)
+                pipette.move_to(dst_top)
+            pipette.blow_out(protocol.fixed_trash["A1"])
         pipette.drop_tip()
 
     protocol.home()